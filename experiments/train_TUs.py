@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
 import os
-import copy
 import time
+import math
 import argparse
+import inspect
+from contextlib import nullcontext
+from functools import partial
 import numpy as np
 import pandas as pd
 from collections import defaultdict
 
 import torch
+import torch.distributed as dist
 from torch import nn, optim
-from torch_geometric.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DistributedSampler, Subset
+from torch_geometric.loader import DataLoader
 from torch_geometric.datasets import TUDataset
 import torch_geometric.utils as utils
 from sat.models import GraphTransformer
-from sat.data import GraphDataset, TUUtil
+from sat.data import GraphDataset, TUUtil, BucketBatchSampler
 from sat.position_encoding import POSENCODINGS
 from sat.gnn_layers import GNN_TYPES
 from sat.utils import add_zeros, extract_node_feature, seed_everything, count_parameters, print_gpu_utilization, \
@@ -22,6 +28,9 @@ from timeit import default_timer as timer
 from tqdm import tqdm
 
 
+AMP_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
 def load_args():
     parser = argparse.ArgumentParser(
         description='Structure-Aware Transformer on OGBG-PPA',
@@ -41,6 +50,8 @@ def load_args():
     parser.add_argument('--weight-decay', type=float, default=1e-4, help='weight decay')
     parser.add_argument('--batch-size', type=int, default=32,
                         help='batch size')
+    parser.add_argument('--grad-accum-steps', type=int, default=1,
+                        help='number of batches to accumulate gradients over per optimizer step')
     parser.add_argument('--abs-pe', type=str, default=None, choices=POSENCODINGS.keys(),
                         help='which absolute PE to use?')
     parser.add_argument('--abs-pe-dim', type=int, default=20, help='dimension for absolute PE')
@@ -68,46 +79,56 @@ def load_args():
     parser.add_argument('--memory_usage', type=int, default=0)
     parser.add_argument('--model_dim', type=int, default=0)
     parser.add_argument('--device_id', type=int, default=0)
+    parser.add_argument('--local_rank', type=int, default=int(os.environ.get('LOCAL_RANK', 0)),
+                        help='local process rank, set by torchrun')
+
+    # Data loading
+    parser.add_argument('--num-workers', type=int, default=min(8, os.cpu_count() or 1),
+                        help='number of DataLoader worker processes')
+    parser.add_argument('--prefetch-factor', type=int, default=2,
+                        help='batches prefetched per worker (keep small, 2-4)')
+    parser.add_argument('--compile', action='store_true',
+                        help='compile the model with torch.compile')
+    parser.add_argument('--amp', type=str, default='off', choices=['off', 'bf16', 'fp16'],
+                        help='mixed precision mode (CUDA only)')
+    parser.add_argument('--bucket-by-size', action='store_true',
+                        help='batch training graphs of similar size together')
+    parser.add_argument('--pe-cache-dir', type=str, default=None,
+                        help='directory to cache absolute PEs of the whole dataset')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='directory to cache extracted k-hop subgraphs (khopgnn only)')
 
     args = parser.parse_args()
+    if args.compile and not hasattr(torch, 'compile'):
+        raise ValueError("--compile requires torch >= 2.0")
+    if args.amp != 'off' and not hasattr(torch, 'autocast'):
+        raise ValueError("--amp requires torch >= 1.10")
+    if args.grad_accum_steps < 1:
+        raise ValueError("--grad-accum-steps must be at least 1")
     args.use_cuda = torch.cuda.is_available()
+    # launched with torchrun on more than one process
+    args.distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+    if args.distributed:
+        if not args.use_cuda:
+            raise ValueError("Distributed training requires CUDA")
+        if args.bucket_by_size:
+            raise ValueError("--bucket-by-size is not supported with distributed training")
+        args.device = torch.device('cuda:{}'.format(args.local_rank))
+    elif args.use_cuda:
+        args.device = torch.device('cuda:{}'.format(args.device_id))
+    else:
+        args.device = torch.device('cpu')
     args.batch_norm = not args.layer_norm
+    args.use_amp = args.use_cuda and args.amp != 'off'
 
     args.save_logs = False
     if args.outdir != '':
         args.save_logs = True
-        outdir = args.outdir
-        if not os.path.exists(outdir):
-            try:
-                os.makedirs(outdir)
-            except Exception:
-                pass
-        outdir = outdir + '/{}'.format(args.dataset)
-        if not os.path.exists(outdir):
-            try:
-                os.makedirs(outdir)
-            except Exception:
-                pass
-        outdir = outdir + '/seed{}'.format(args.seed)
-        if not os.path.exists(outdir):
-            try:
-                os.makedirs(outdir)
-            except Exception:
-                pass
+        outdir = args.outdir + '/{}/seed{}'.format(args.dataset, args.seed)
         if args.use_edge_attr:
             outdir = outdir + '/edge_attr'
-            if not os.path.exists(outdir):
-                try:
-                    os.makedirs(outdir)
-                except Exception:
-                    pass
         pedir = 'None' if args.abs_pe is None else '{}_{}'.format(args.abs_pe, args.abs_pe_dim)
         outdir = outdir + '/{}'.format(pedir)
-        if not os.path.exists(outdir):
-            try:
-                os.makedirs(outdir)
-            except Exception:
-                pass
         bn = 'BN' if args.batch_norm else 'LN'
         if args.se == "khopgnn":
             outdir = outdir + '/{}_{}_{}_{}_{}_{}_{}_{}_{}_{}'.format(
@@ -119,100 +140,195 @@ def load_args():
                 args.gnn_type, args.k_hop, args.dropout, args.lr, args.weight_decay,
                 args.num_layers, args.num_heads, args.dim_hidden, bn,
             )
-        if not os.path.exists(outdir):
-            try:
-                os.makedirs(outdir)
-            except Exception:
-                pass
+        os.makedirs(outdir, exist_ok=True)
         args.outdir = outdir
     return args
 
 
-def train_epoch(model, loader, criterion, optimizer, lr_scheduler, epoch, use_cuda=False):
+def seed_worker(worker_id, seed=0):
+    seed_everything(seed + worker_id)
+
+
+def subgraph_cache_path():
+    # GraphDataset stores one file per TU graph index under this prefix, so
+    # the cache is shared by every run, split and seed
+    if args.cache_dir is None or args.se != 'khopgnn':
+        return None
+    os.makedirs(args.cache_dir, exist_ok=True)
+    edge = 'edge_attr' if args.use_edge_attr else 'no_edge_attr'
+    return os.path.join(args.cache_dir, '{}_khop{}_{}'.format(
+        args.dataset, args.k_hop, edge))
+
+
+def init_distributed(args):
+    args.rank = 0
+    if args.use_cuda:
+        torch.cuda.set_device(args.device)
+    if not args.distributed:
+        return
+    dist.init_process_group('nccl')
+    args.rank = dist.get_rank()
+    if args.rank != 0:
+        # only rank 0 logs and writes results
+        args.save_logs = False
+
+
+def autocast():
+    # torch.autocast needs torch >= 1.10, so it is only touched when AMP is on
+    if not args.use_amp:
+        return nullcontext()
+    return torch.autocast('cuda', dtype=AMP_DTYPES[args.amp])
+
+
+def grad_scaler(enabled):
+    # torch.cuda.amp.GradScaler is deprecated in favour of torch.amp.GradScaler
+    # (torch >= 2.3), but is the only one available on older versions
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def train_epoch(model, loader, criterion, optimizer, scaler, lr_scheduler, device='cpu'):
     model.train()
 
-    running_loss = 0.0
+    # accumulate on device, so that logging does not sync at every step
+    running_loss = torch.zeros((), device=device)
+    n_sample = torch.zeros((), device=device)
+
+    accum_steps = args.grad_accum_steps
+    optimizer.zero_grad(set_to_none=True)
 
     tic = timer()
     for i, data in enumerate(loader):
         size = len(data.y)
-        if epoch < args.warmup:
-            iteration = epoch * len(loader) + i
-            for param_group in optimizer.param_groups:
-                param_group["lr"] = lr_scheduler(iteration)
+        data = data.to(device, non_blocking=True)
+
         if args.abs_pe == 'lap':
             # sign flip as in Bresson et al. for laplacian PE
-            sign_flip = torch.rand(data.abs_pe.shape[-1])
-            sign_flip[sign_flip >= 0.5] = 1.0
-            sign_flip[sign_flip < 0.5] = -1.0
+            sign_flip = (torch.rand(data.abs_pe.shape[-1], device=data.abs_pe.device) >= 0.5).float() * 2 - 1
             data.abs_pe = data.abs_pe * sign_flip.unsqueeze(0)
 
-        if use_cuda:
-            data = data.cuda()
-
-        optimizer.zero_grad()
-        output = model(data)
-
-        loss = criterion(output, data.y.squeeze())
-        loss.backward()
-        optimizer.step()
+        step = (i + 1) % accum_steps == 0 or i + 1 == len(loader)
+        # the last group of an epoch may hold fewer than accum_steps batches
+        group_start = i - i % accum_steps
+        group_size = min(accum_steps, len(loader) - group_start)
+        # only the batch that steps the optimizer needs to all-reduce gradients
+        sync_context = model.no_sync() if not step and hasattr(model, 'no_sync') else nullcontext()
+        with sync_context:
+            with autocast():
+                output = model(data)
+                loss = criterion(output, data.y.view(-1))
+            scaler.scale(loss / group_size).backward()
+        if step:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+            lr_scheduler.step()
 
-        running_loss += loss.item() * size
+        running_loss += loss.detach().float() * size
+        n_sample += size
 
+    if args.distributed:
+        # each rank only sees its shard of the training set
+        dist.all_reduce(running_loss)
+        dist.all_reduce(n_sample)
     toc = timer()
-    n_sample = len(loader.dataset)
-    epoch_loss = running_loss / n_sample
-    print('Train loss: {:.4f} time: {:.2f}s'.format(
-        epoch_loss, toc - tic))
+    epoch_loss = running_loss.item() / n_sample.item()
+    if args.rank == 0:
+        print('Train loss: {:.4f} time: {:.2f}s'.format(
+            epoch_loss, toc - tic))
     return epoch_loss
 
 
-def eval_epoch(model, loader, criterion, use_cuda=False, split='Val'):
+def eval_epoch(model, loader, criterion, device='cpu', split='Val'):
     model.eval()
 
-    running_loss = 0.0
+    running_loss = torch.zeros((), device=device)
 
     tic = timer()
-    correct = 0
+    correct = torch.zeros((), device=device, dtype=torch.long)
     with torch.no_grad():
-        for step, batch in enumerate(tqdm(loader, desc="Eval")):
+        for batch in tqdm(loader, desc="Eval", disable=args.rank != 0):
             size = len(batch.y)
-            batch = batch.cuda()
+            batch = batch.to(device, non_blocking=True)
 
-            pred = model(batch)
-            loss = criterion(pred, batch.y.squeeze())
+            with autocast():
+                pred = model(batch)
+                loss = criterion(pred, batch.y.view(-1))
             pred = pred.max(dim=1)[1]
-            correct += pred.eq(batch.y).sum().item()
-            running_loss += loss.item() * size
+            correct += pred.eq(batch.y.view(-1)).sum()
+            running_loss += loss.float() * size
 
     toc = timer()
 
     n_sample = len(loader.dataset)
-    epoch_loss = running_loss / n_sample
+    epoch_loss = running_loss.item() / n_sample
 
-    score = correct / len(loader.dataset)
-    print('{} loss: {:.4f} score: {:.4f} time: {:.2f}s'.format(
-        split, epoch_loss, score, toc - tic))
+    score = correct.item() / n_sample
+    if args.rank == 0:
+        print('{} loss: {:.4f} score: {:.4f} time: {:.2f}s'.format(
+            split, epoch_loss, score, toc - tic))
     return score, epoch_loss
 
 
-def main(run_id=0):
-    global args
-    args = load_args()
-    seed_everything(args.seed + run_id)
+def build_data(args):
+    # everything that only depends on the graphs (node features, degrees,
+    # k-hop subgraphs, absolute PEs) is computed once over the whole dataset
+    # and shared by all runs; each run only draws its own split of indices
+    if args.distributed and args.rank != 0:
+        # let rank 0 download/process the dataset and write the on-disk
+        # caches first, then load them from there
+        dist.barrier()
     data_path = '../../data'
-    # for TU Datasets
-    num_edge_features = 0
 
     if args.not_extract_node_feature:
         transform = None
     else:
-        from functools import partial
         transform = partial(extract_node_feature, reduce=args.aggr)
 
     dataset = TUDataset(name=args.dataset, root=data_path,
                         transform=transform)
-    dataset = TUUtil.preprocess(dataset)
+    dataset = TUUtil.add_node_features(dataset)
+
+    # absolute PEs are computed in parallel, optionally cached on disk
+    abs_pe_list = None
+    if args.abs_pe and args.abs_pe_dim > 0:
+        cache_file = None
+        if args.pe_cache_dir is not None:
+            os.makedirs(args.pe_cache_dir, exist_ok=True)
+            cache_file = os.path.join(args.pe_cache_dir, '{}_{}_{}.pt'.format(
+                args.dataset, args.abs_pe, args.abs_pe_dim))
+        if cache_file is not None and os.path.exists(cache_file):
+            abs_pe_list = torch.load(cache_file)
+        else:
+            abs_pe_method = POSENCODINGS[args.abs_pe]
+            abs_pe_encoder = abs_pe_method(args.abs_pe_dim, normalization='sym')
+            abs_pe_list = abs_pe_encoder.compute_pe_list(dataset, args.num_workers)
+            if cache_file is not None and args.rank == 0:
+                torch.save(abs_pe_list, cache_file)
+
+    graph_dset = GraphDataset(dataset, degree=True,
+                              k_hop=args.k_hop, se=args.se, use_subgraph_edge_attr=args.use_edge_attr,
+                              cache_path=subgraph_cache_path(),
+                              return_complete_index=False)
+    graph_dset.abs_pe_list = abs_pe_list
+    graph_dset.precompute()
+    if args.distributed and args.rank == 0:
+        dist.barrier()
+    return dataset, graph_dset
+
+
+def train_one_run(args, tu_dataset, graph_dset, run_id=0):
+    seed_everything(args.seed + run_id)
+    # TF32 matmuls on Ampere+; cudnn.benchmark stays off since batch shapes vary
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    if hasattr(torch, 'set_float32_matmul_precision'):  # torch >= 1.12
+        torch.set_float32_matmul_precision('high')
+    # for TU Datasets
+    num_edge_features = 0
+
+    dataset = TUUtil.split(tu_dataset)
 
     if args.not_extract_node_feature:
         input_size = dataset.num_features
@@ -221,31 +337,47 @@ def main(run_id=0):
 
     split_idx = dataset.get_idx_split()
 
-    train_dset = GraphDataset(dataset[split_idx['train']], degree=True,
-                              k_hop=args.k_hop, se=args.se, use_subgraph_edge_attr=args.use_edge_attr,
-                              return_complete_index=False)
-
-    train_loader = DataLoader(train_dset, batch_size=args.batch_size, shuffle=True)
-
-    val_dset = GraphDataset(dataset[split_idx['valid']], degree=True,
-                            k_hop=args.k_hop, se=args.se, use_subgraph_edge_attr=args.use_edge_attr,
-                            return_complete_index=False)
-    val_loader = DataLoader(val_dset, batch_size=args.batch_size, shuffle=False)
-
-    abs_pe_encoder = None
-    if args.abs_pe and args.abs_pe_dim > 0:
-        abs_pe_method = POSENCODINGS[args.abs_pe]
-        abs_pe_encoder = abs_pe_method(args.abs_pe_dim, normalization='sym')
-        if abs_pe_encoder is not None:
-            abs_pe_encoder.apply_to(train_dset)
-            abs_pe_encoder.apply_to(val_dset)
+    # num_subgraph_nodes is only needed by Data.__inc__ while collating, and
+    # edge_attr is only read by the model with --use-edge-attr
+    exclude_keys = ['num_subgraph_nodes']
+    if not args.use_edge_attr:
+        exclude_keys.append('edge_attr')
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': args.use_cuda,
+                     'exclude_keys': exclude_keys}
+    if args.num_workers > 0:
+        loader_kwargs.update(persistent_workers=True,
+                             prefetch_factor=args.prefetch_factor,
+                             worker_init_fn=partial(seed_worker, seed=args.seed + run_id))
+
+    # views of the shared, already processed graphs
+    train_dset = Subset(graph_dset, dataset[split_idx['train']].indices)
+
+    val_dset = Subset(graph_dset, dataset[split_idx['valid']].indices)
+    val_loader = DataLoader(val_dset, batch_size=args.batch_size, shuffle=False, **loader_kwargs)
+
+    if args.bucket_by_size:
+        batch_sampler = BucketBatchSampler([data.num_nodes for data in train_dset], args.batch_size)
+        train_loader = DataLoader(train_dset, batch_sampler=batch_sampler, **loader_kwargs)
+    elif args.distributed:
+        # val/test are small, so every rank evaluates them in full and
+        # reports exact scores; only training is sharded
+        sampler = DistributedSampler(train_dset, shuffle=True, seed=args.seed + run_id)
+        train_loader = DataLoader(train_dset, batch_size=args.batch_size, sampler=sampler, **loader_kwargs)
+    else:
+        train_loader = DataLoader(train_dset, batch_size=args.batch_size, shuffle=True, **loader_kwargs)
 
     if 'pna' in args.gnn_type or args.gnn_type == 'mpnn':
-        deg = torch.cat([
-            utils.degree(data.edge_index[1], num_nodes=data.num_nodes) for data in train_dset])
+        # in-degrees of all training nodes, from a single pass over the
+        # concatenated (offset) edge indices
+        num_nodes = torch.tensor([data.num_nodes for data in train_dset])
+        offsets = torch.cumsum(num_nodes, 0) - num_nodes
+        edge_dst = torch.cat([
+            data.edge_index[1] + offset for data, offset in zip(train_dset, offsets.tolist())])
+        deg = utils.degree(edge_dst, num_nodes=int(num_nodes.sum()))
     else:
         deg = None
-    print("in_size: {}".format(input_size))
+    if args.rank == 0:
+        print("in_size: {}".format(input_size))
     model = GraphTransformer(in_size=input_size,
                              num_class=dataset.num_classes,
                              d_model=args.dim_hidden,
@@ -266,78 +398,114 @@ def main(run_id=0):
                              in_embed=False,
                              edge_embed=False,
                              global_pool=args.global_pool)
-    if args.use_cuda:
-        model.cuda()
+    model.to(args.device)
     args.total_params = count_parameters(model)
-    print('total_params: {}'.format(args.total_params))
+    # keep a handle on the eager module for state_dict save/restore
+    raw_model = model
+    if args.distributed:
+        # static_graph is a constructor argument from torch 1.11. DDP's
+        # static-graph setup needs a synced first iteration, which gradient
+        # accumulation skips by starting inside no_sync(), so it is only used
+        # without accumulation
+        ddp_kwargs = {}
+        if args.grad_accum_steps == 1 and \
+                'static_graph' in inspect.signature(DistributedDataParallel).parameters:
+            ddp_kwargs['static_graph'] = True
+        model = DistributedDataParallel(model, device_ids=[args.local_rank],
+                                        gradient_as_bucket_view=True, **ddp_kwargs)
+    if args.compile:
+        # graphs have a variable number of nodes, so compile with dynamic shapes.
+        # reduce-overhead replays CUDA graphs for the captured regions; a manual
+        # torch.cuda.graph capture of the whole step is not possible since
+        # pad_batch/unpad_batch read batch sizes back with .item()
+        torch._dynamo.config.cache_size_limit = 64
+        model = torch.compile(model, mode='reduce-overhead', dynamic=True)
+    if args.rank == 0:
+        print('total_params: {}'.format(args.total_params))
 
     criterion = nn.CrossEntropyLoss()
-    optimizer = optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
-
-    lr_scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, args.epochs - args.warmup)
-
-    lr_steps = args.lr / (args.warmup * len(train_loader))
-
-    def warmup_lr_scheduler(s):
-        lr = s * lr_steps
-        return lr
-
-    test_dset = GraphDataset(dataset[split_idx['test']], degree=True,
-                             k_hop=args.k_hop, se=args.se, use_subgraph_edge_attr=args.use_edge_attr,
-                             return_complete_index=False)
-    test_loader = DataLoader(test_dset, batch_size=args.batch_size, shuffle=False)
-
-    if abs_pe_encoder is not None:
-        abs_pe_encoder.apply_to(test_dset)
-
-    print("Training...")
+    # loss scaling is only needed for fp16; a disabled scaler is a no-op wrapper
+    scaler = grad_scaler(args.use_amp and args.amp == 'fp16')
+    # single multi-tensor kernel per step instead of one launch per parameter;
+    # AdamW only accepts foreach from torch 1.12 and fused from torch 2.0
+    adamw_params = inspect.signature(optim.AdamW).parameters
+    optimizer_kwargs = {}
+    if args.use_cuda and 'fused' in adamw_params:
+        optimizer_kwargs['fused'] = True
+    elif 'foreach' in adamw_params:
+        optimizer_kwargs['foreach'] = True
+    optimizer = optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay,
+                            **optimizer_kwargs)
+
+    # linear warmup followed by cosine annealing, stepped once per optimizer step.
+    # A single LambdaLR keeps this working on torch < 1.10 (no LinearLR/SequentialLR)
+    steps_per_epoch = math.ceil(len(train_loader) / args.grad_accum_steps)
+    warmup_iters = args.warmup * steps_per_epoch
+    cosine_iters = max(1, (args.epochs - args.warmup) * steps_per_epoch)
+
+    def lr_lambda(step):
+        if step < warmup_iters:
+            return step / warmup_iters
+        return 0.5 * (1. + math.cos(math.pi * min(step - warmup_iters, cosine_iters) / cosine_iters))
+
+    lr_scheduler = optim.lr_scheduler.LambdaLR(optimizer, lr_lambda)
+
+    test_dset = Subset(graph_dset, dataset[split_idx['test']].indices)
+    test_loader = DataLoader(test_dset, batch_size=args.batch_size, shuffle=False, **loader_kwargs)
+
+    if args.rank == 0:
+        print("Training...")
     best_val_loss = float('inf')
     best_val_score = 0
     best_model = None
     best_epoch = 0
+    # CPU buffers for the best weights, refreshed in place on improvement
+    best_weights = {k: v.detach().cpu().clone() for k, v in raw_model.state_dict().items()}
     logs = defaultdict(list)
     t0 = time.time()
     per_epoch_time = []
-    test_time = []
     start_time = timer()
     for epoch in range(args.epochs):
+        if args.distributed:
+            train_loader.sampler.set_epoch(epoch)
         start = time.time()
-        print("Epoch {}/{}, LR {:.6f}".format(epoch + 1, args.epochs, optimizer.param_groups[0]['lr']))
-        train_loss = train_epoch(model, train_loader, criterion, optimizer, warmup_lr_scheduler, epoch, args.use_cuda)
-        val_score, val_loss = eval_epoch(model, val_loader, criterion, args.use_cuda, split='Val')
-        t_test_start = time.time()
-        test_score, test_loss = eval_epoch(model, test_loader, criterion, args.use_cuda, split='Test')
-        test_time.append(time.time() - t_test_start)
+        if args.rank == 0:
+            print("Epoch {}/{}, LR {:.6f}".format(epoch + 1, args.epochs, optimizer.param_groups[0]['lr']))
+        train_loss = train_epoch(model, train_loader, criterion, optimizer, scaler, lr_scheduler,
+                                 args.device)
+        val_score, val_loss = eval_epoch(model, val_loader, criterion, args.device, split='Val')
         # memory usage
-        if epoch == 1:
-            mem = print_gpu_utilization(0)
+        if epoch == 1 and args.use_cuda:
+            mem = print_gpu_utilization(args.device.index)
             args.memory_usage = mem
 
-        if epoch >= args.warmup:
-            lr_scheduler.step()
-
         logs['train_loss'].append(train_loss)
         logs['val_score'].append(val_score)
-        logs['test_score'].append(test_score)
         if val_score > best_val_score:
             best_val_score = val_score
             best_val_loss = val_loss
             best_epoch = epoch
-            best_weights = copy.deepcopy(model.state_dict())
+            for k, v in raw_model.state_dict().items():
+                best_weights[k].copy_(v.detach())
         per_epoch_time.append(time.time() - start)
 
     total_time = timer() - start_time
     total_time_taken = time.time() - t0
     avg_time_epoch = np.mean(per_epoch_time)
-    avg_test_time = np.mean(test_time)
-    print("best epoch: {} best val score: {:.4f}".format(best_epoch, best_val_score))
-    model.load_state_dict(best_weights)
+    if args.rank == 0:
+        print("best epoch: {} best val score: {:.4f}".format(best_epoch, best_val_score))
+    raw_model.load_state_dict(best_weights)
 
-    print()
-    print("Testing...")
-    test_score, test_loss = eval_epoch(model, test_loader, criterion, args.use_cuda, split='Test')
+    if args.rank == 0:
+        print()
+        print("Testing...")
+    # the test set is only needed for the selected model, so it is evaluated once
+    t_test_start = time.time()
+    test_score, test_loss = eval_epoch(model, test_loader, criterion, args.device, split='Test')
+    avg_test_time = time.time() - t_test_start
 
-    print("test ACC {:.4f}".format(test_score))
+    if args.rank == 0:
+        print("test ACC {:.4f}".format(test_score))
 
     if args.save_logs:
         logs = pd.DataFrame.from_dict(logs)
@@ -364,8 +532,12 @@ if __name__ == "__main__":
     test_scores, test_losses, vals, total_time_list, avg_time_list, test_time_list = [], [], [], [], [], []
     total_params, memory = 0, 0
 
+    args = load_args()
+    init_distributed(args)
+    tu_dataset, graph_dset = build_data(args)
     for run_id in range(10):
-        test_score, test_loss, val, total_time, avg_time, test_time, total_params, memory = main(run_id)
+        test_score, test_loss, val, total_time, avg_time, test_time, total_params, memory = \
+            train_one_run(args, tu_dataset, graph_dset, run_id)
 
         test_scores.append(test_score)
         test_losses.append(test_loss)
@@ -374,10 +546,12 @@ if __name__ == "__main__":
         avg_time_list.append(avg_time)
         test_time_list.append(test_time)
 
-    args = load_args()
     args.total_params, args.memory_usage = total_params, memory
-    results_to_file(args, np.mean(test_scores), np.std(test_scores),
-                    np.mean(test_losses), np.std(test_losses),
-                    np.mean(total_time_list), np.std(total_time_list),
-                    np.mean(avg_time_list), np.std(avg_time_list),
-                    np.mean(test_time_list), np.std(test_time_list))
+    if args.rank == 0:
+        results_to_file(args, np.mean(test_scores), np.std(test_scores),
+                        np.mean(test_losses), np.std(test_losses),
+                        np.mean(total_time_list), np.std(total_time_list),
+                        np.mean(avg_time_list), np.std(avg_time_list),
+                        np.mean(test_time_list), np.std(test_time_list))
+    if args.distributed:
+        dist.destroy_process_group()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import torch
-from torch.utils.data import random_split
+from torch.utils.data import random_split, Sampler
 import torch.nn.functional as F
 from torch.utils.data.dataloader import default_collate
 import torch_geometric.utils as utils
@@ -37,6 +37,7 @@ class GraphDataset(object):
         self.se = se
         self.use_subgraph_edge_attr = use_subgraph_edge_attr
         self.cache_path = cache_path
+        self._cache = None
         if self.se == 'khopgnn':
             Data.__inc__ = my_inc
             self.extract_subgraphs()
@@ -117,10 +118,19 @@ class GraphDataset(object):
                     self.subgraph_edge_attr.append(torch.cat(edge_attributes))
         print("Done!")
 
+    def precompute(self):
+        # materialize every processed graph once, so that the dataset
+        # transform and subgraph lookups are not repeated at every epoch.
+        # Call this after the positional encodings have been applied.
+        self._cache = None
+        self._cache = [self[i] for i in range(len(self))]
+
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, index):
+        if self._cache is not None:
+            return self._cache[index]
         data = self.dataset[index]
 
         if self.n_features == 1:
@@ -163,6 +173,46 @@ class GraphDataset(object):
         return data
 
 
+class BucketBatchSampler(Sampler):
+    # yields batches of graphs with similar numbers of nodes, which limits the
+    # padding in dense attention. A random permutation is cut into pools of
+    # batch_size * bucket_size_multiplier graphs, each pool is sorted by size
+    # and split into batches, and the batches are shuffled overall.
+    def __init__(self, sizes, batch_size, bucket_size_multiplier=50, shuffle=True,
+                 drop_last=False):
+        self.sizes = torch.as_tensor(sizes)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def _num_batches(self, n):
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.sizes)
+        order = torch.randperm(n) if self.shuffle else torch.arange(n)
+
+        batches = []
+        for pool in order.split(self.bucket_size):
+            pool = pool[torch.argsort(self.sizes[pool])]
+            for batch in pool.split(self.batch_size):
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return iter(batches)
+
+    def __len__(self):
+        n = len(self.sizes)
+        full, rest = divmod(n, self.bucket_size)
+        return full * self._num_batches(self.bucket_size) + self._num_batches(rest)
+
+
 class NormalizedDegree(object):
     def __init__(self, mean, std):
         self.mean = mean
@@ -188,6 +238,11 @@ class FeatureUnsqueeze(object):
 class TUUtil:
     @staticmethod
     def preprocess(dataset):
+        dataset = TUUtil.add_node_features(dataset)
+        return TUUtil.split(dataset)
+
+    @staticmethod
+    def add_node_features(dataset):
         if dataset.data.x is None:
             #  print('features are None!')
             max_degree = 0
@@ -207,7 +262,10 @@ class TUUtil:
                 dataset.transform = T.Compose([
                     NormalizedDegree(mean, std),
                 ])
+        return dataset
 
+    @staticmethod
+    def split(dataset):
         num_tasks = dataset.num_classes
 
         num_features = dataset.num_features
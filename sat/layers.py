@@ -150,7 +150,9 @@ class Attention(gnn.MessagePassing):
         qk_i = rearrange(qk_i, 'n (h d) -> n h d', h=self.num_heads)
         qk_j = rearrange(qk_j, 'n (h d) -> n h d', h=self.num_heads)
         v_j = rearrange(v_j, 'n (h d) -> n h d', h=self.num_heads)
-        attn = (qk_i * qk_j).sum(-1) * self.scale
+        # per-edge dot product as a batched (1 x d) @ (d x 1) matmul rather
+        # than an elementwise product followed by a reduction
+        attn = torch.matmul(qk_i.unsqueeze(-2), qk_j.unsqueeze(-1)).view(qk_i.shape[:-1]) * self.scale
         if edge_attr is not None:
             attn = attn + edge_attr
         attn = utils.softmax(attn, index, ptr, size_i)
@@ -1,18 +1,39 @@
 import os
 import pickle
 import torch
+import torch.multiprocessing as mp
 from torch_scatter import scatter_add
 import torch_geometric.utils as utils
 import numpy as np
 
 
+_pe_worker_state = {}
+
+
+def _init_pe_worker(encoder, dataset):
+    # with fork, the encoder and dataset are inherited rather than pickled
+    _pe_worker_state['encoder'] = encoder
+    _pe_worker_state['dataset'] = dataset
+
+
+def _compute_pe_worker(index):
+    # return numpy arrays so results are pickled instead of going through
+    # torch's shared-memory tensor transport, one file descriptor per tensor
+    pe = _pe_worker_state['encoder'].compute_pe(_pe_worker_state['dataset'][index])
+    return pe.numpy()
+
+
 class PositionEncoding(object):
-    def apply_to(self, dataset):
-        dataset.abs_pe_list = []
-        for i, g in enumerate(dataset):
-            pe = self.compute_pe(g)
-            dataset.abs_pe_list.append(pe)
+    def compute_pe_list(self, dataset, num_workers=0):
+        if num_workers <= 1:
+            return [self.compute_pe(dataset[i]) for i in range(len(dataset))]
+        with mp.Pool(num_workers, initializer=_init_pe_worker,
+                     initargs=(self, dataset)) as pool:
+            pe_list = pool.map(_compute_pe_worker, range(len(dataset)), chunksize=64)
+        return [torch.from_numpy(pe) for pe in pe_list]
 
+    def apply_to(self, dataset, num_workers=0):
+        dataset.abs_pe_list = self.compute_pe_list(dataset, num_workers)
         return dataset
 
 